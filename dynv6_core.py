@@ -0,0 +1,512 @@
+import hashlib
+import ipaddress
+import json
+import os
+import socket
+import ssl
+import sys
+import time
+import urllib.parse
+
+from pathlib import Path
+
+
+ROOT = Path(__file__).parent
+RECORDS_FILE = ROOT / ".records"
+ZONE_FILE = ROOT / ".zone"
+ZONES_CACHE_FILE = ROOT / ".zones_cache"
+LAST_UPDATE_FILE = ROOT / ".last_update"
+DYNV6_ADDRESS_FILE = ROOT / ".dynv6_ip"
+
+# Zone IDs already found by this process, keyed on the domain and a hash of the token
+ZONE_IDS = {}
+
+# dynv6 allows roughly one update per minute
+MIN_UPDATE_INTERVAL = 60
+
+DYNV6_HOST = "dynv6.com"
+DYNV6_PREFIX = f"https://{DYNV6_HOST}/api/v2/zones"
+# A stale address is caught by the connection or certificate check and looked up again, so it can
+# outlive the interval between runs
+DYNV6_ADDRESS_TTL = 86400
+
+# If /proc/net/if_inet6 has no global ipv6 address, we have to connect to something to get the
+# host's ipv6 address. This is a Google public DNS server.
+IPV6_EXTERNAL_ADDRESS = "2001:4860:4860:0:0:0:0:8888"
+
+# Linux's list of the host's ipv6 addresses
+IF_INET6_FILE = Path("/proc/net/if_inet6")
+# Temporary, duplicate, deprecated, and tentative addresses are poor targets for a record
+IF_INET6_SKIPPED_FLAGS = 0x01 | 0x08 | 0x20 | 0x40
+
+
+def make_session(token):
+    """Create a session that reuses one connection for every request to dynv6."""
+    # requests takes longer to import than most runs need, so only load it once an update is due
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.utils import select_proxy
+    from urllib3.exceptions import NewConnectionError, SSLError
+
+    def connection_failed(error):
+        """Check whether `error` happened before any of the request reached dynv6."""
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        if isinstance(reason, NewConnectionError):
+            return True
+        # A rejected certificate stops the handshake, but other TLS errors can arrive after the
+        # request was sent (e.g. while reading the response)
+        return (
+            isinstance(reason, SSLError)
+            and bool(reason.args)
+            and isinstance(reason.args[0], ssl.SSLCertVerificationError)
+        )
+
+    class PinnedAddressAdapter(HTTPAdapter):
+        """Connects to dynv6 at cached addresses while still verifying its certificate by name."""
+
+        def __init__(self, addresses, **kwargs):
+            self.addresses = addresses
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs["server_hostname"] = DYNV6_HOST
+            kwargs["assert_hostname"] = DYNV6_HOST
+            super().init_poolmanager(*args, **kwargs)
+
+        def send(self, request, **kwargs):
+            url = request.url
+            # A proxy connects to dynv6 itself and its pool does not carry the pinned hostname
+            if select_proxy(url, kwargs.get("proxies")):
+                return super().send(request, **kwargs)
+            request.headers["Host"] = DYNV6_HOST
+            tried = set()
+            error = None
+            for refresh in (False, True):
+                if refresh:
+                    # Every cached address failed; they may be out of date, so look them up again
+                    self.addresses = resolve_dynv6(refresh=True)
+                for address in self.addresses:
+                    if address in tried:
+                        continue
+                    tried.add(address)
+                    request.url = pin_address(url, address)
+                    try:
+                        response = super().send(request, **kwargs)
+                    except requests.exceptions.ConnectionError as connection_error:
+                        # Only retry if the request was never sent, so nothing is applied twice
+                        if not connection_failed(connection_error):
+                            raise
+                        error = connection_error
+                        continue
+                    # Try the address that worked first for the rest of the session
+                    self.addresses = [address] + [a for a in self.addresses if a != address]
+                    return response
+            raise error
+
+    session = requests.Session()
+    session.headers.update(
+        {
+            "Accept": "application/json",
+            "Authorization": f"Bearer {token}",
+        }
+    )
+    addresses = resolve_dynv6()
+    if addresses:
+        adapter = PinnedAddressAdapter(addresses, pool_connections=1, pool_maxsize=4)
+    else:
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+    session.mount(f"https://{DYNV6_HOST}/", adapter)
+    return session
+
+
+def resolve_dynv6(refresh=False):
+    """Look up dynv6's addresses, using the cached ones in `.dynv6_ip` if they are fresh enough."""
+    if not refresh:
+        try:
+            if time.time() - DYNV6_ADDRESS_FILE.stat().st_mtime < DYNV6_ADDRESS_TTL:
+                addresses = read_json(DYNV6_ADDRESS_FILE)
+                if isinstance(addresses, list) and addresses:
+                    return addresses
+        except FileNotFoundError:
+            pass
+    try:
+        address_info = socket.getaddrinfo(DYNV6_HOST, 443, type=socket.SOCK_STREAM)
+    except OSError:
+        return []
+    # Keep the order getaddrinfo prefers, but only one entry per address
+    addresses = list(dict.fromkeys(info[4][0] for info in address_info))
+    write_json(DYNV6_ADDRESS_FILE, addresses)
+    return addresses
+
+
+def pin_address(url, address):
+    """Replace the host in `url` with `address`."""
+    parts = urllib.parse.urlsplit(url)
+    host = f"[{address}]" if ":" in address else address
+    if parts.port:
+        host = f"{host}:{parts.port}"
+    return urllib.parse.urlunsplit(parts._replace(netloc=host))
+
+
+def read_json(path):
+    """Load the JSON contents of `path`, or None if it is missing or malformed."""
+    try:
+        with open(path, "r", encoding="utf8") as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return None
+    except json.decoder.JSONDecodeError:
+        return None
+
+
+def write_json(path, data):
+    """Store `data` in `path` as JSON, replacing the old contents in one step."""
+    # Write to a separate file first so that an interrupted run cannot leave a truncated cache
+    temporary_path = path.with_name(f"{path.name}.tmp")
+    with open(temporary_path, "w", encoding="utf8") as json_file:
+        json_file.write(json.dumps(data))
+        json_file.write("\n")
+    os.replace(temporary_path, path)
+
+
+def discover_global_ipv6(device=None):
+    """Find a global ipv6 address of this host (on `device`, if given) without network traffic."""
+    try:
+        with open(IF_INET6_FILE, "r", encoding="utf8") as if_inet6:
+            for line in if_inet6:
+                address, _index, _prefix_length, _scope, flags, name = line.split()
+                if device and name != device:
+                    continue
+                if int(flags, 16) & IF_INET6_SKIPPED_FLAGS:
+                    continue
+                address = ipaddress.IPv6Address(bytes.fromhex(address))
+                if address.is_global:
+                    return str(address)
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def cached_zones(ttl_seconds=86400):
+    """Retrieve the cached mapping of zone names to IDs, or an empty one if it is stale."""
+    try:
+        if time.time() - ZONES_CACHE_FILE.stat().st_mtime < ttl_seconds:
+            return read_json(ZONES_CACHE_FILE) or {}
+    except FileNotFoundError:
+        pass
+    return {}
+
+
+def get_zone(domain, session):
+    """Retrieve the ID of the zone that matches `domain`."""
+    zone_ids = cached_zones()
+    if domain not in zone_ids:
+        # Look up only the zone we need rather than listing every zone in the account
+        response = session.get(f"{DYNV6_PREFIX}/by-name/{domain}")
+        if response.status_code == 404:
+            print(f"dynv6 has no zone named {domain}", file=sys.stderr)
+            return None
+        if response.status_code != 200:
+            print(
+                f"Error looking up zone {domain}: {response} ({response.reason})",
+                file=sys.stderr,
+            )
+            return None
+        zone_id = response.json().get("id")
+        if zone_id is None:
+            print(f"Error looking up zone {domain}: {response.json()}", file=sys.stderr)
+            return None
+        zone_ids[domain] = zone_id
+        write_json(ZONES_CACHE_FILE, zone_ids)
+    return zone_ids[domain]
+
+
+def get_zone_cached(domain, token, session):
+    """Retrieve the ID of the zone that matches `domain`, remembering it for the process."""
+    key = (domain, hashlib.sha256(token.encode("utf8")).hexdigest())
+    if key not in ZONE_IDS:
+        zone_id = get_zone(domain, session)
+        # Failed lookups are not remembered so that a later call can try again
+        if zone_id is None:
+            return None
+        ZONE_IDS[key] = zone_id
+    return ZONE_IDS[key]
+
+
+class ConfigurationError(Exception):
+    """Raised when the settings and cache files do not describe a zone to update."""
+
+
+class Updater:
+    """Points the A and AAAA records for `prefix` in a dynv6 zone at this host.
+
+    The zone may be given by name (`zone`), by ID (`zone_id`), or left for the cache in `.zone`.
+    An empty `prefix` updates the zone's own addresses.
+    """
+
+    def __init__(
+        self,
+        token,
+        zone=None,
+        zone_id=None,
+        prefix="",
+        ipv4=False,
+        device=None,
+        ipv6_external_address=IPV6_EXTERNAL_ADDRESS,
+    ):
+        self.token = token
+        self.zone = zone
+        self.zone_id = zone_id
+        self.prefix = prefix
+        self.ipv4 = ipv4
+        self.device = device
+        self.ipv6_external_address = ipv6_external_address
+
+        self.cache_id4 = None
+        self.cache_id6 = None
+        self.cache_address4 = None
+        self.cache_address6 = None
+
+    @property
+    def zone_level(self):
+        """An empty prefix refers to the zone itself, whose addresses are set without record IDs."""
+        return not self.prefix
+
+    def load_cache(self):
+        """Fill in the zone and record state from `.zone` and `.records`."""
+        contents = read_json(ZONE_FILE) or {}
+        cache_zone = contents.get("name")
+        cache_zone_id = contents.get("id")
+
+        # Manual validation of zone and zone_id
+
+        if self.zone is None:
+            self.zone = cache_zone
+        else:
+            assert cache_zone is None or cache_zone == self.zone
+
+        if self.zone_id is None:
+            self.zone_id = cache_zone_id
+        else:
+            assert cache_zone_id is None or cache_zone_id == self.zone_id
+
+        if self.zone is None and self.zone_id is None:
+            raise ConfigurationError(
+                "A zone must be specified. It may be specified with -z "
+                f"or -i on the command line or as `name` or `id` in {ZONE_FILE}"
+            )
+
+        for record in read_json(RECORDS_FILE) or []:
+            # If there is a name but it doesn't match the specified prefix, ignore it
+            name = record.get("name")
+            if name and name != self.prefix:
+                continue
+            # Look up A (ipv4) and AAAA (ipv6) data from the cache
+            if record.get("type") == "A":
+                assert self.cache_id4 is None and self.cache_address4 is None
+                self.cache_id4 = record.get("id")
+                self.cache_address4 = record.get("data")
+            elif record.get("type") == "AAAA":
+                assert self.cache_id6 is None and self.cache_address6 is None
+                self.cache_id6 = record.get("id")
+                self.cache_address6 = record.get("data")
+
+    def discover_ipv4(self):
+        """Retrieve this host's publicly-visible ipv4 address, if ipv4 updates are enabled."""
+        if not self.ipv4:
+            return None
+        # Like requests, urllib.request is only worth importing when it is used
+        import urllib.request
+
+        with urllib.request.urlopen("https://api.ipify.org") as response:
+            return response.read().decode("utf8")
+
+    def discover_ipv6(self):
+        """Find this host's ipv6 address, or None if it has none."""
+        address = discover_global_ipv6(self.device)
+        if address is not None:
+            return address
+        try:
+            # Attempt to connect to an external host using ipv6 and then get the socket's IP address
+            with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+                if self.device:
+                    sock.setsockopt(
+                        socket.SOL_SOCKET, socket.SO_BINDTODEVICE, bytes(self.device, "utf-8")
+                    )
+                sock.connect((self.ipv6_external_address, 1))
+                return sock.getsockname()[0]
+        except OSError:
+            return None
+
+    def needs_update(self, current_address4, current_address6):
+        """Check whether the cached records differ from the current addresses."""
+        needs_update = False
+        if current_address4 is not None:
+            needs_update |= current_address4 != self.cache_address4
+            needs_update |= self.cache_id4 is None and not self.zone_level
+        if current_address6 is not None:
+            needs_update |= current_address6 != self.cache_address6
+            needs_update |= self.cache_id6 is None and not self.zone_level
+        return needs_update
+
+    def find_records(self, session, current_address4, current_address6):
+        """If there is no cached record ID for the prefix, query dynv6 and look for a match."""
+        update4 = self.cache_id4 is None and current_address4 is not None
+        update6 = self.cache_id6 is None and current_address6 is not None
+        if self.zone_level or not (update4 or update6):
+            return
+        records = session.get(f"{DYNV6_PREFIX}/{self.zone_id}/records").json()
+        for record in records:
+            if record.get("name") == self.prefix:
+                if update4 and record.get("type") == "A":
+                    self.cache_address4 = record["data"]
+                    self.cache_id4 = record["id"]
+                elif update6 and record.get("type") == "AAAA":
+                    self.cache_address6 = record["data"]
+                    self.cache_id6 = record["id"]
+
+    def update_zone(self, session, records):
+        """Change both of the zone's addresses with a single request."""
+        addresses = {}
+        for record in records:
+            if record["type"] == "A":
+                addresses["ipv4address"] = record["data"]
+            else:
+                addresses["ipv6prefix"] = record["data"]
+        print(f"Updating zone {self.zone_id}: {addresses}")
+        result = session.patch(f"{DYNV6_PREFIX}/{self.zone_id}", json=addresses)
+        if result.status_code != 200:
+            print(
+                f"Error updating zone {self.zone_id}: {result} ({result.reason})",
+                file=sys.stderr,
+            )
+            return []
+        print(f"Successfully updated zone {self.zone_id}")
+        return records
+
+    def update_records(self, session, records):
+        """Create or update each record, returning the ones that dynv6 accepted."""
+        results = []
+        tasks = []
+        for record in records:
+            if record["id"] is None:
+                print(f"Creating a new record: {record}")
+                # A JSON body would send the missing ID as null, so leave it out
+                body = {key: value for key, value in record.items() if key != "id"}
+                tasks.append(("POST", f"{DYNV6_PREFIX}/{self.zone_id}/records", body))
+            else:
+                print(f"Updating an existing record ({record['id']})")
+                tasks.append(
+                    (
+                        "PATCH",
+                        f"{DYNV6_PREFIX}/{self.zone_id}/records/{record['id']}",
+                        record,
+                    )
+                )
+        # dynv6 rate-limits updates to a zone, so the requests are sent one at a time
+        responses = [session.request(method, url, json=body) for method, url, body in tasks]
+
+        for record, result in zip(records, responses):
+            if record["id"] is None:
+                if result.status_code != 200:
+                    print(
+                        f"Error creating a new record: {result} ({result.reason})",
+                        file=sys.stderr,
+                    )
+                    continue
+                record["id"] = result.json().get("id")
+                print(record)
+            else:
+                # PATCH
+                if result.status_code != 200:
+                    print(f"Error updating a record: {result}", file=sys.stderr)
+                    continue
+                # Only cache confirmed updates; an unchanged cache skips the next run entirely
+                result_id = result.json().get("id")
+                if result_id:
+                    if record["id"] == result_id:
+                        print(f"Successfully updated {record['id']}: {record['data']}")
+                    else:
+                        print(
+                            f"Error! Attempted to update record {record['id']}"
+                            f" but updated {result_id} instead."
+                        )
+                        continue
+                else:
+                    print(
+                        f"Error updating record {record['id']}: {result} ({result.json()})",
+                        file=sys.stderr,
+                    )
+                    continue
+            results.append(record)
+        return results
+
+    def run(self):
+        """Bring dynv6 up to date and return the records now stored in `.records`."""
+        self.load_cache()
+
+        current_address4 = self.discover_ipv4()
+        current_address6 = self.discover_ipv6()
+
+        # Skip all further network traffic if the cached records are already current
+        if not self.needs_update(current_address4, current_address6):
+            print("no changes")
+            return []
+
+        try:
+            since_last_update = time.time() - LAST_UPDATE_FILE.stat().st_mtime
+            if since_last_update < MIN_UPDATE_INTERVAL:
+                print(
+                    f"Skipping update; the last one was {since_last_update:.0f} seconds ago",
+                    file=sys.stderr,
+                )
+                return []
+        except FileNotFoundError:
+            pass
+
+        session = make_session(self.token)
+
+        if self.zone_id is None:
+            self.zone_id = get_zone_cached(self.zone, self.token, session)
+            if self.zone_id is None:
+                return []
+
+        self.find_records(session, current_address4, current_address6)
+
+        records = []
+        results = []
+
+        # Fields shared by every record for this prefix
+        base = {"name": self.prefix}
+
+        # Records that dynv6 already holds (per the cache or the listing above) are not rewritten
+        for record_type, cache_id, cache_address, current_address in (
+            ("A", self.cache_id4, self.cache_address4, current_address4),
+            ("AAAA", self.cache_id6, self.cache_address6, current_address6),
+        ):
+            if current_address is None:
+                continue
+            record = {**base, "id": cache_id, "type": record_type, "data": current_address}
+            if (self.zone_level or cache_id is not None) and cache_address == current_address:
+                print(f"Address unchanged: {current_address}")
+                results.append(record)
+            else:
+                records.append(record)
+
+        if self.zone_level:
+            results.extend(self.update_zone(session, records))
+        else:
+            results.extend(self.update_records(session, records))
+
+        LAST_UPDATE_FILE.touch()
+
+        zone_data = {"id": self.zone_id}
+        if self.zone:
+            zone_data["name"] = self.zone
+        write_json(ZONE_FILE, zone_data)
+
+        if results:
+            write_json(RECORDS_FILE, results)
+        return results